@@ -1,46 +1,85 @@
+import maya.api.OpenMaya as om2
 import maya.cmds as cmds
 import maya.mel as mel
 
 # the name of the yeti graph editor window
 YETI_WIN = 'pgYetiGraphPanelWindow'
 
+# values of the type param on import nodes
+_IMPORT_TYPES = {
+    'geometry': 0,
+    'groom': 1,
+    'guides': 2,
+    'feather': 3,
+    'braid': 4,
+}
+
+# pgYetiGraph flags used to set each type of param
+_PARAM_SETTERS = {
+    'scalar': 'setParamValueScalar',
+    'string': 'setParamValueString',
+    'vector': 'setParamValueVector',
+    'expression': 'setParamValueExpr',
+    'boolean': 'setParamValueBoolean',
+}
+
+# mel proc that dumps every import node of a yeti node along with its type and
+# selection in one go, one tab separated line per node
+_DUMP_IMPORTS_PROC = r'''
+global proc string yt_dumpImports(string $yeti)
+{
+    string $result = "";
+    string $nodes[] = `pgYetiGraph -listNodes -type "import" $yeti`;
+    for ($node in $nodes) {
+        float $type = `pgYetiGraph -node $node -param "type" -getParamValue $yeti`;
+        string $geometry = `pgYetiGraph -node $node -param "geometry" -getParamValue $yeti`;
+        $result += $node + "\t" + $type + "\t" + $geometry + "\n";
+    }
+    return $result;
+}
+'''
+_DUMP_IMPORTS_SOURCED = False
+
 
 def get_sel_grooms():
     """
     Returns groom shape nodes from selection
     """
-    sel = cmds.ls(sl=1)
-    grooms = []
-    for obj in sel:
-        shape = str()
+    return cmds.ls(sl=1, dag=1, shapes=1, type='pgYetiGroom') or []
 
-        if cmds.objectType(obj) == 'transform':
-            shape = cmds.listRelatives(obj, shapes=1)[0]
-        else:
-            shape = obj
 
-        if cmds.objectType(shape) == 'pgYetiGroom':
-            grooms.append(shape)
+def _curve_handles():
+    """
+    Returns handles to every nurbs curve shape in the scene
+    """
+    handles = []
+    it = om2.MItDependencyNodes(om2.MFn.kNurbsCurve)
+    while not it.isDone():
+        handles.append(om2.MObjectHandle(it.thisNode()))
+        it.next()
 
-    return grooms
+    return handles
 
 
 def groom_to_curves(groom):
     # unfortunately, the convert to curves command doesn't return anything
     # so we have to get all the curves before and after the command is run
-    # to get the new curves
-    before_curves = cmds.ls(type='nurbsCurve')
-    cmds.select(groom)
+    # to get the new curves, only those are turned into names
+    before_curves = set(h.hashCode() for h in _curve_handles())
+    # the command may read the groom from the selection as well, so keep it
+    # selected but don't expand it
+    cmds.select(groom, replace=True, noExpand=True)
     mel.eval('pgYetiCommand -convertToCurves {}'.format(groom))
-    after_curves = cmds.ls(type='nurbsCurve')
-    new_curves = [c for c in after_curves if c not in before_curves]
-    new_curves_transforms = [
-        cmds.listRelatives(c, parent=1)[0] for c in new_curves
+    new_curves = [
+        om2.MDagPath.getAPathTo(h.object()).partialPathName()
+        for h in _curve_handles() if h.hashCode() not in before_curves
     ]
     new_curve_dict = {}
     if new_curves:
-        transform = cmds.listRelatives(new_curves[0], parent=1)[0]
-        guide_set = cmds.listConnections(transform, type='objectSet')[0]
+        # an empty list would make listRelatives fall back to the selection
+        new_curves_transforms = cmds.listRelatives(new_curves, parent=1)
+        guide_set = cmds.listConnections(new_curves_transforms[0],
+                                         type='objectSet')[0]
         cmds.sets(new_curves_transforms, add=guide_set)
         new_curve_dict[guide_set] = new_curves
 
@@ -51,110 +90,150 @@ def yetis_from_groom(groom):
     """
     Get a list of all Yeti nodes that a groom is connected to
     """
-    yetis = cmds.listConnections(groom, type='pgYetiMaya')
+    sel = om2.MSelectionList()
+    sel.add(groom)
+    groom_fn = om2.MFnDependencyNode(sel.getDependNode(0))
+
+    yetis = []
+    for plug in groom_fn.getConnections():
+        for other in plug.connectedTo(True, True):
+            node = other.node()
+            if om2.MFnDependencyNode(node).typeName != 'pgYetiMaya':
+                continue
+            # yeti nodes are shapes, so use a unique path rather than the name
+            yeti = om2.MDagPath.getAPathTo(node).partialPathName()
+            if yeti not in yetis:
+                yetis.append(yeti)
+
     return yetis
 
 
-def create_node(yeti, type, name=None):
+def create_node(yeti, type, name=None, refresh=True):
     """
-    Wrapper for the graph creation mel command
+    Wrapper for the graph creation command
     """
-    node = mel.eval('pgYetiGraph -create -type "{type}" {yeti}'.format(
-        type=type, yeti=yeti))
+    node = cmds.pgYetiGraph(yeti, create=True, type=type)
 
     # disconnect the inputs
-    mel.eval('pgYetiGraph -disconnect 0 -node {node} {yeti}'.format(node=node,
-                                                                    yeti=yeti))
+    cmds.pgYetiGraph(yeti, node=node, disconnect=0)
 
     # rename the node if a name is given
     if name:
-        mel.eval('pgYetiGraph -node "{node}" -rename "{name}" {yeti}'.format(
-            node=node, name=name, yeti=yeti))
+        cmds.pgYetiGraph(yeti, node=node, rename=name)
         node = name
 
     # force graph refresh to prevent crashing if another node is created
-    refresh_graph()
+    if refresh:
+        refresh_graph()
 
     return node
 
 
-def get_imports(yeti, type, selection=None):
+def _enumerate_imports(yeti):
+    """
+    List (node, type, selection) for every import node in a given Yeti node,
+    queried with a single mel call
+    """
+    global _DUMP_IMPORTS_SOURCED
+    if not _DUMP_IMPORTS_SOURCED:
+        mel.eval(_DUMP_IMPORTS_PROC)
+        _DUMP_IMPORTS_SOURCED = True
+
+    imports = []
+    dump = mel.eval('yt_dumpImports("{yeti}")'.format(yeti=yeti)) or ''
+    for line in dump.splitlines():
+        imp_node, imp_type, imp_selection = line.split('\t')
+        imports.append((imp_node, int(float(imp_type)), imp_selection))
+
+    return imports
+
+
+def get_imports(yeti, type, selection=None, imports=None):
     """
     List all import nodes of a certain type in a given Yeti node
 
     Optionally specify the selection to filter imports that only have that
     string specified in the selection field.
+
+    The result of _enumerate_imports can be passed in as imports to avoid
+    querying the graph again when filtering the same Yeti node several times.
     """
-    type_dict = {
-        'geometry': 0,
-        'groom': 1,
-        'guides': 2,
-        'feather': 3,
-        'braid': 4,
-    }
+    if imports is None:
+        imports = _enumerate_imports(yeti)
 
-    imp_nodes = mel.eval(
-        'pgYetiGraph -listNodes -type "import" {yeti}'.format(yeti=yeti))
-
-    type_nodes = []
-    for imp_node in imp_nodes:
-        curr_type = mel.eval(
-            'pgYetiGraph -node {node} -param "type" -getParamValue {yeti}'.
-            format(node=imp_node, yeti=yeti))
-        if curr_type == type_dict[type]:
-            if selection:
-                curr_selection = mel.eval(
-                    'pgYetiGraph -node {node} -param "geometry" -getParamValue {yeti}'
-                    .format(node=imp_node, yeti=yeti))
-                if curr_selection == selection:
-                    type_nodes.append(imp_node)
-            else:
-                type_nodes.append(imp_node)
+    imp_type = _IMPORT_TYPES[type]
+    if not selection:
+        return [node for node, curr_type, _ in imports if curr_type == imp_type]
 
-    return type_nodes
+    # a selection of '*' is matched literally, it finds wildcard imports
+    return [
+        node for node, curr_type, curr_selection in imports
+        if curr_type == imp_type and curr_selection == selection
+    ]
 
 
-def set_param(yeti, param, node, val, type):
+def set_param(yeti, param, node, val, type, refresh=False):
     """
     Wrapper for param setting command
+
+    Values are passed straight to the pgYetiGraph command, so vectors are
+    (x, y, z) tuples and strings or expressions don't need mel quoting. The old
+    mel style values, a "x y z" string for vectors and quoted strings, are
+    still accepted and converted.
     """
-    type_dict = {
-        'scalar': 'setParamValueScalar',
-        'string': 'setParamValueString ',
-        'vector': 'setParamValueVector',
-        'expression': 'setParamValueExpr',
-        'boolean': 'setParamValueBoolean',
-    }
+    if type == 'vector' and isinstance(val, str):
+        val = tuple(float(v) for v in val.split())
+    elif type in ('string', 'expression') and isinstance(val, str):
+        if len(val) > 1 and val[0] == val[-1] == '"':
+            val = val[1:-1]
 
-    mel.eval('pgYetiGraph -node {node} -param "{param}" -{type} {val} {yeti}'.
-             format(node=node,
-                    param=param,
-                    type=type_dict[type],
-                    val=val,
-                    yeti=yeti))
+    cmds.pgYetiGraph(yeti, node=node, param=param,
+                     **{_PARAM_SETTERS[type]: val})
 
-    refresh_graph()
+    if refresh:
+        refresh_graph()
 
 
-def connect_nodes(yeti, from_node, to_node, input):
+def connect_nodes(yeti, from_node, to_node, input, refresh=False):
     """
     Wrapper for node connecting command
     """
-    mel.eval('pgYetiGraph -node {from_node} -connect {to_node} {input} {yeti}'.
-             format(from_node=from_node,
-                    to_node=to_node,
-                    input=input,
-                    yeti=yeti))
+    cmds.pgYetiGraph(yeti, node=from_node, connect=(to_node, input))
+
+    if refresh:
+        refresh_graph()
+
+
+def connect_many(yeti, connections, refresh=False):
+    """
+    Wrapper for making several node connections with a single mel call
 
-    refresh_graph()
+    connections is a list of (from_node, to_node, input) tuples, use
+    connect_nodes for a single connection
+    """
+    # unlike the other wrappers this stays on mel, joining all the connections
+    # into one string crosses into maya once instead of once per connection
+    mel.eval(''.join(
+        'pgYetiGraph -node "{from_node}" -connect "{to_node}" {input} '
+        '"{yeti}";'.format(from_node=from_node, to_node=to_node, input=input,
+                           yeti=yeti)
+        for from_node, to_node, input in connections))
+
+    if refresh:
+        refresh_graph()
 
 
 def refresh_graph():
     """
     Opens and then closes the graph editor to help with stability when creting nodes
+
+    Does nothing in batch mode, where there is no graph editor to refresh.
     """
+    if cmds.about(batch=True):
+        return
+
     mel.eval('pgYetiTearOffGraphPanel')
-    if YETI_WIN in cmds.lsUI(type='window'):
+    if cmds.window(YETI_WIN, exists=True):
         cmds.deleteUI(YETI_WIN)
 
 
@@ -171,7 +250,7 @@ def guided_grooms():
     """
     # store the state of the graph window
     graph_open = 0
-    if YETI_WIN in cmds.lsUI(type='window'):
+    if cmds.window(YETI_WIN, exists=True):
         refresh_graph()
         graph_open = 1
 
@@ -180,15 +259,19 @@ def guided_grooms():
         yeti_nodes = yetis_from_groom(groom)
         # convert the groom to curves
         groom_dict = groom_to_curves(groom)
+        # query the import nodes of every yeti node up front so the loop
+        # below only has to make edits
+        yeti_imports = {yeti: _enumerate_imports(yeti) for yeti in yeti_nodes}
 
         for yeti in yeti_nodes:
+            imports = yeti_imports[yeti]
             # get all of the geometry nodes
-            geo_nodes = get_imports(yeti, 'geometry')
+            geo_nodes = get_imports(yeti, 'geometry', imports=imports)
             # get all of the groom nodes
-            groom_nodes = get_imports(yeti, 'groom', groom)
+            groom_nodes = get_imports(yeti, 'groom', groom, imports=imports)
             # if we can't find an explicit groom node, use a wildcard groom
             if not groom_nodes:
-                groom_nodes = get_imports(yeti, 'groom', '*')
+                groom_nodes = get_imports(yeti, 'groom', '*', imports=imports)
 
             if not groom_nodes:
                 cmds.warning(
@@ -202,44 +285,54 @@ def guided_grooms():
 
             # if we've got at least one groom node and only one geo node, let's go!
             else:
+                guide_set = next(iter(groom_dict))
+                guide_curves = groom_dict[guide_set]
+
                 # add the guide sets to the yeti nodes
                 mel.eval('pgYetiAddGuideSet("{guide_set}", "{yeti}")'.format(
-                    guide_set=groom_dict.keys()[0], yeti=yeti))
+                    guide_set=guide_set, yeti=yeti))
 
                 # import the guides into the yeti node
-                guide_import = create_node(yeti, 'import',
-                                           groom_dict.keys()[0])
+                guide_import = create_node(yeti, 'import', guide_set)
 
                 # switch the import mode to guides
                 set_param(yeti, 'type', guide_import, 2, 'scalar')
 
                 # set the selection to the guide set
-                set_param(yeti, 'geometry', guide_import,
-                          groom_dict.keys()[0], 'string')
-
-                # set guide attrs
-                cmds.setAttr(
-                    groom_dict.keys()[0] + '.maxNumberOfGuideInfluences', 1)
-                for guide in groom_dict[groom_dict.keys()[0]]:
-                    cmds.setAttr(guide + '.weight', 10)
-                    cmds.setAttr(guide + '.tipAttraction', 1)
-                    cmds.setAttr(guide + '.baseAttraction', 1)
+                set_param(yeti, 'geometry', guide_import, guide_set, 'string')
+
+                # set guide attrs, as a single undo chunk
+                cmds.undoInfo(openChunk=True)
+                try:
+                    cmds.setAttr(guide_set + '.maxNumberOfGuideInfluences', 1)
+                    # batched into one mel call, there can be hundreds of guides
+                    mel.eval(''.join(
+                        'setAttr {guide}.weight 10;'
+                        'setAttr {guide}.tipAttraction 1;'
+                        'setAttr {guide}.baseAttraction 1;'.format(guide=guide)
+                        for guide in guide_curves))
+                finally:
+                    cmds.undoInfo(closeChunk=True)
 
                 for groom_node in groom_nodes:
-                    # convert the grooms
                     convert_node = create_node(yeti, 'convert')
-                    connect_nodes(yeti, groom_node, convert_node, 0)
-                    connect_nodes(yeti, geo_nodes[0], convert_node, 1)
-
-                    # create guide node
                     guide_node = create_node(yeti, 'guide')
-                    connect_nodes(yeti, convert_node, guide_node, 0)
-                    connect_nodes(yeti, guide_import, guide_node, 1)
-
-                    # set up blending
                     blend_node = create_node(yeti, 'blend')
-                    connect_nodes(yeti, convert_node, blend_node, 0)
-                    connect_nodes(yeti, guide_node, blend_node, 1)
+
+                    connect_many(yeti, [
+                        # convert the grooms
+                        (groom_node, convert_node, 0),
+                        (geo_nodes[0], convert_node, 1),
+                        # guide the converted groom
+                        (convert_node, guide_node, 0),
+                        (guide_import, guide_node, 1),
+                        # set up blending
+                        (convert_node, blend_node, 0),
+                        (guide_node, blend_node, 1),
+                    ])
+
+                # one refresh for all the connections made above
+                refresh_graph()
 
 
     # show the graph?